@@ -1,9 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from enum import Enum
-from typing import Any, List
-import json
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Union
+import mmap
+import numpy as np
+import orjson
 import os
-import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 import re
 
 
@@ -49,6 +54,117 @@ class AnnotatedDoc:
     annotations: List[Annotation]
 
 
+# a document yielded by a reader: its text and (id, start, end, category, text) of each of its annotations
+DocumentAnnotations = Tuple[str, List[Tuple[str, int, int, str, str]]]
+
+
+@dataclass
+class AnnotationsSoA:
+    """
+        Annotations of a list of documents stored column-wise (one column per Annotation field), in document order.
+        Annotations of the i-th document are stored at positions [doc_offsets[i], doc_offsets[i + 1]).
+        Categories and sources are stored as codes, see `categories` and AnnotationSource values respectively.
+        String columns are plain lists, numeric columns are NumPy arrays.
+    """
+    doc_offsets: np.ndarray
+    id: List[str]
+    file_id: np.ndarray
+    start: np.ndarray
+    end: np.ndarray
+    category_code: np.ndarray
+    text: List[str]
+    source_code: np.ndarray
+    categories: List[str]
+
+    @classmethod
+    def from_columns(
+        cls, doc_sizes: List[int], id: List[str], file_id: List[int], start: List[int], end: List[int],
+        category: List[str], text: List[str], source: Union[AnnotationSource, List[AnnotationSource]]
+    ) -> 'AnnotationsSoA':
+        """
+            Build column-wise annotations from lists of Annotation field values accumulated by a reader.
+
+            Args:
+                doc_sizes (List[int]): number of annotations of each document
+                id (List[str]): annotation ids
+                file_id (List[int]): ids of annotated files (documents)
+                start (List[int]): start offsets of annotations
+                end (List[int]): end offsets of annotations
+                category (List[str]): categories of annotations
+                text (List[str]): annotated texts
+                source (Union[AnnotationSource, List[AnnotationSource]]): source of all the annotations,
+                                                                          or of each of them
+            Returns:
+                AnnotationsSoA: annotations of all documents
+        """
+        doc_offsets = np.zeros(len(doc_sizes) + 1, dtype=np.int64)
+        np.cumsum(doc_sizes, out=doc_offsets[1:])
+        category_codes: Dict[str, int] = dict()
+        category_code = [category_codes.setdefault(c, len(category_codes)) for c in category]
+        if isinstance(source, AnnotationSource):
+            source_code = np.full(len(text), source.value, dtype=np.int8)
+        else:
+            source_code = np.array([s.value for s in source], dtype=np.int8)
+
+        return cls(
+            doc_offsets=doc_offsets,
+            id=id,
+            file_id=np.array(file_id, dtype=np.int32),
+            start=np.array(start, dtype=np.int32),
+            end=np.array(end, dtype=np.int32),
+            category_code=np.array(category_code, dtype=np.int32),
+            text=text,
+            source_code=source_code,
+            categories=list(category_codes)
+        )
+
+    @classmethod
+    def from_annotated_docs(cls, docs: List[AnnotatedDoc]) -> 'AnnotationsSoA':
+        """
+            Convert documents with lists of Annotation objects into column-wise annotations.
+
+            Args:
+                docs (List[AnnotatedDoc]): documents to convert
+            Returns:
+                AnnotationsSoA: annotations of all documents
+        """
+        annotations = [annotation for doc in docs for annotation in doc.annotations]
+        return cls.from_columns(
+            [len(doc.annotations) for doc in docs],
+            [a.id for a in annotations],
+            [a.file_id for a in annotations],
+            [a.start for a in annotations],
+            [a.end for a in annotations],
+            [a.category for a in annotations],
+            [a.text for a in annotations],
+            [a.source for a in annotations]
+        )
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[DocumentAnnotations], source: AnnotationSource) -> 'AnnotationsSoA':
+        """
+            Build column-wise annotations of documents yielded by a reader, the i-th document gets file id i.
+
+            Args:
+                documents (Iterable[DocumentAnnotations]): documents, see DocumentAnnotations
+                source (AnnotationSource): source of all the annotations
+            Returns:
+                AnnotationsSoA: annotations of all documents
+        """
+        doc_sizes, file_ids = [], []
+        columns: List[list] = [[], [], [], [], []]
+        for i, (_, annotations) in enumerate(documents):
+            doc_sizes.append(len(annotations))
+            file_ids.extend([i] * len(annotations))
+            for column, values in zip(columns, zip(*annotations)):
+                column.extend(values)
+        ids, starts, ends, categories, texts = columns
+        return cls.from_columns(doc_sizes, ids, file_ids, starts, ends, categories, texts, source)
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+
 @dataclass
 class LabelWithIRI:
     """ Tuple of ontology entity label and its IRI. Also a normalized label is present """
@@ -58,9 +174,28 @@ class LabelWithIRI:
     similarity_representation: Any = None
 
 
+# BRAT text-bound annotation: "{id}\t{category} {start} {end}\t{text}"
+_BRAT_TEXT_BOUND_RE = re.compile(rb"^(T[^\t]*)\t(\S+) (\d+) (\d+)\t([^\t]*?)\s*$")
+
+_CATEGORY_TO_ENTITY_TYPE = {
+    'unit': EntityType.UNIT,
+    'quantity': EntityType.QUANTITY,
+    'process': EntityType.PROCESS,
+    'color': EntityType.COLOR,
+    'physical_quality': EntityType.PHYSICAL_QUALITY,
+    'diet': EntityType.DIET,
+    'part': EntityType.PART,
+    'purpose': EntityType.PURPOSE,
+    'taste': EntityType.TASTE,
+}
+
+
+@lru_cache(maxsize=4096)
 def get_entity_type(category: str) -> EntityType:
     """
-        Map BRAT categories to common NER/BRAT categories defined in EntityType class
+        Map BRAT categories to common NER/BRAT categories defined in EntityType class.
+        Categories containing 'food' as well as 'possible_substite', 'example', 'trade_name', 'excluded',
+        'exclusive' and all unknown categories are mapped to FOOD.
 
         Args:
             category (str): category from NER or BRAT
@@ -68,54 +203,43 @@ def get_entity_type(category: str) -> EntityType:
             EntityType: category as a shared EntityType object
 
     """
-    category = category.lower()
-    if 'food' in category or category in ['possible_substite', 'example', 'trade_name', 'excluded', 'exclusive']:
-        return EntityType.FOOD
-    elif category == 'unit':
-        return EntityType.UNIT
-    elif category == 'quantity':
-        return EntityType.QUANTITY
-    elif category == 'process':
-        return EntityType.PROCESS
-    elif category == 'color':
-        return EntityType.COLOR
-    elif category == 'physical_quality':
-        return EntityType.PHYSICAL_QUALITY
-    elif category == 'diet':
-        return EntityType.DIET
-    elif category == 'part':
-        return EntityType.PART
-    elif category == 'purpose':
-        return EntityType.PURPOSE
-    elif category == 'taste':
-        return EntityType.TASTE
-    return EntityType.FOOD
+    return _CATEGORY_TO_ENTITY_TYPE.get(category.lower(), EntityType.FOOD)
 
 
 def read_brat_all_annotation_files(folder_path: str) -> list[AnnotatedDoc]:
-    annotations = []
     """
-        Iterate over all BRAT annotations in a folder and parse them into a list of AnnotatedDocs
+        Iterate over all BRAT annotations in a folder and parse them into a list of AnnotatedDocs.
+        Files are read concurrently by a pool of threads.
 
         Args:
             folder_path (str): Path to a folder with all annotations
         Returns:
             list[AnnotatedDoc]: List of parsed annotations
     """
+    with os.scandir(folder_path) as it:
+        paths = [
+            entry.path for entry in it if entry.is_file() and entry.name.endswith("txt")
+        ]
 
-    for filename in os.listdir(folder_path):
-        f = os.path.join(folder_path, filename)
-        if os.path.isfile(f) and f.endswith("txt"):
-            ann_path = f"{f[:-4]}.ann"
-            id = get_file_id(f)
-            with open(f) as brat_file:
-                text = brat_file.read()
-            brat_annotations = read_brat_annotations_from_file(ann_path)
-            annotated_doc = AnnotatedDoc(
-                id=id, path=f, text=text, annotations=brat_annotations
-            )
-            annotations.append(annotated_doc)
-    return annotations
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        return list(executor.map(read_brat_annotated_doc, paths))
+
+
+def read_brat_annotated_doc(file_path: str) -> AnnotatedDoc:
+    """
+        Read a BRAT document ({num}.txt) together with its annotations ({num}.ann)
+
+        Args:
+            file_path (str): Path to a BRAT text file
+        Returns:
+            AnnotatedDoc: parsed document
+    """
+    with open(file_path) as brat_file:
+        text = brat_file.read()
+    return AnnotatedDoc(
+        id=get_file_id(file_path), path=file_path, text=text,
+        annotations=read_brat_annotations_from_file(f"{file_path[:-4]}.ann")
+    )
 
 
 def read_brat_annotations_from_file(file_path: str) -> List[Annotation]:
@@ -128,29 +252,27 @@ def read_brat_annotations_from_file(file_path: str) -> List[Annotation]:
             list[Annotation]: List of parsed annotations
     """
     annotations = []
+    file_id = get_file_id(file_path)
 
-    with open(file_path, "r") as f:
+    with open(file_path, "rb") as f:
         for line in f:
-            if line.startswith("T"):
-                # filter annotations other than tokens
-                id, details, text = line.strip().split("\t")
-                if ";" in details:
-                    # skip discontinuous annotations
-                    continue
-
-                category, start, end = details.split()
-                file_id = get_file_id(file_path)
-                annotations.append(
-                    Annotation(
-                        id=id,
-                        file_id=file_id,
-                        start=int(start),
-                        end=int(end),
-                        category=category,
-                        text=text,
-                        source=AnnotationSource.BRAT
-                    )
+            # filter annotations other than tokens, discontinuous annotations (start end;start end) do not match either
+            match = _BRAT_TEXT_BOUND_RE.match(line)
+            if match is None:
+                continue
+
+            id, category, start, end, text = match.groups()
+            annotations.append(
+                Annotation(
+                    id=id.decode(),
+                    file_id=file_id,
+                    start=int(start),
+                    end=int(end),
+                    category=category.decode(),
+                    text=text.decode(),
+                    source=AnnotationSource.BRAT
                 )
+            )
     return annotations
 
 
@@ -163,21 +285,38 @@ def read_ner_annotation_file(file_path: str) -> list[AnnotatedDoc]:
         Returns:
             list[AnnotatedDoc]: List of parsed annotations
     """
-    annotations = []
-    with open(file_path) as f:
-        documents = json.load(f)
-        for i, doc in enumerate(documents):
-            ner_annotations = []
-            for j, entity in enumerate(doc['entities_list']):
-                ner_annotations.append(Annotation(
-                    id=str(j), file_id=i, start=entity['start'],
-                    end=entity['end'], category=entity['label'],
-                    text=entity['text'], source=AnnotationSource.NER))
-
-            annotations.append(AnnotatedDoc(
-                id=i, path=file_path, text=doc['text'], annotations=ner_annotations
-            ))
-    return annotations
+    return _to_annotated_docs(_read_ner_documents(file_path), file_path, AnnotationSource.NER)
+
+
+def read_ner_annotation_file_soa(file_path: str) -> AnnotationsSoA:
+    """
+        Read all NER annotations in a file column-wise, without creating an Annotation object per annotation.
+        Equivalent to `AnnotationsSoA.from_annotated_docs(read_ner_annotation_file(file_path))`.
+
+        Args:
+            file_path (str): Path to a file with NER output
+        Returns:
+            AnnotationsSoA: annotations of all documents
+    """
+    return AnnotationsSoA.from_documents(_read_ner_documents(file_path), AnnotationSource.NER)
+
+
+def _read_ner_documents(file_path: str) -> Iterator[DocumentAnnotations]:
+    """ Parse a NER output file, a JSON list of documents with their texts and 'entities_list' """
+    with open(file_path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+            memoryview(mm) as buffer:
+        documents = orjson.loads(buffer)
+
+    for doc in documents:
+        yield doc['text'], [
+            (str(j), entity['start'], entity['end'], entity['label'], entity['text'])
+            for j, entity in enumerate(doc['entities_list'])
+        ]
+
+
+# size of blocks in which the TAISTI CSV dataset is parsed (and reported as processed)
+TAISTI_CSV_BLOCK_SIZE = 64 * 1024 * 1024
 
 
 def read_taisti_dataset_csv(file_path: str) -> list[AnnotatedDoc]:
@@ -189,27 +328,55 @@ def read_taisti_dataset_csv(file_path: str) -> list[AnnotatedDoc]:
         Returns:
             list[AnnotatedDoc]: List of parsed annotations
     """
-    annotations = []
+    return _to_annotated_docs(_read_taisti_dataset_documents(file_path), file_path, AnnotationSource.TAISTI_CSV)
+
+
+def read_taisti_dataset_csv_soa(file_path: str) -> AnnotationsSoA:
+    """
+        Read all food annotations of the TAISTI CSV dataset column-wise, without creating an Annotation object per annotation.
+        Equivalent to `AnnotationsSoA.from_annotated_docs(read_taisti_dataset_csv(file_path))`.
+
+        Args:
+            file_path (str): Path to a TAISTI CSV dataset file
+        Returns:
+            AnnotationsSoA: annotations of all documents
+    """
+    return AnnotationsSoA.from_documents(_read_taisti_dataset_documents(file_path), AnnotationSource.TAISTI_CSV)
+
+
+def _read_taisti_dataset_documents(file_path: str) -> Iterator[DocumentAnnotations]:
+    """ Iterate over rows of the TAISTI CSV dataset, a row is a document (without text) annotated with food entities """
     idx = 0
-    for df in pd.read_csv(file_path,
-                 usecols=['ingredients_entities'], chunksize=1000):
-        print(f"Processing {idx}")
-        for _, row in df.iterrows():
-            entities = json.loads(row['ingredients_entities'])
-
-            ner_annotations = []
-            for j, entity in enumerate(entities):
-                if 'food' in entity['type'].lower():
-                    ner_annotations.append(Annotation(
-                        id=str(j), file_id=idx, start=entity['start'],
-                        end=entity['end'], category=entity['type'],
-                        text=entity['entity'], source=AnnotationSource.TAISTI_CSV))
-
-            annotations.append(AnnotatedDoc(
-                id=idx, path=file_path, text='', annotations=ner_annotations
-            ))
-            idx += 1
-    return annotations
+    with pa.memory_map(file_path, 'r') as source:
+        reader = pa_csv.open_csv(
+            source,
+            read_options=pa_csv.ReadOptions(block_size=TAISTI_CSV_BLOCK_SIZE),
+            parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=['ingredients_entities'],
+                column_types={'ingredients_entities': pa.string()}))
+        for batch in reader:
+            print(f"Processing {idx}")
+            for ingredients_entities in batch.column(0).to_pylist():
+                entities = orjson.loads(ingredients_entities)
+                yield '', [
+                    (str(j), entity['start'], entity['end'], entity['type'], entity['entity'])
+                    for j, entity in enumerate(entities) if 'food' in entity['type'].lower()
+                ]
+                idx += 1
+
+
+def _to_annotated_docs(
+    documents: Iterable[DocumentAnnotations], file_path: str, source: AnnotationSource
+) -> list[AnnotatedDoc]:
+    """ Build AnnotatedDocs of documents yielded by a reader, the i-th document gets (file) id i """
+    return [
+        AnnotatedDoc(id=i, path=file_path, text=text, annotations=[
+            Annotation(id=id, file_id=i, start=start, end=end, category=category, text=annotated_text, source=source)
+            for id, start, end, category, annotated_text in annotations
+        ])
+        for i, (text, annotations) in enumerate(documents)
+    ]
 
 
 def get_file_id(path: str) -> int:
@@ -221,4 +388,4 @@ def get_file_id(path: str) -> int:
         Returns:
             int: file id
     """
-    return int(re.split(r"[./]", path)[-2])
+    return int(os.path.splitext(os.path.basename(path))[0])
@@ -1,19 +1,101 @@
-from typing import Dict, Optional
-from taisti_linker.commons import (EntityType, LabelWithIRI, get_entity_type,
+from collections.abc import Mapping
+from functools import cached_property, lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from taisti_linker.commons import (AnnotatedDoc, AnnotationSource, AnnotationsSoA,
+                                   EntityType, LabelWithIRI, get_entity_type,
                                    read_brat_all_annotation_files,
                                    read_ner_annotation_file,
-                                   read_taisti_dataset_csv)
+                                   read_ner_annotation_file_soa,
+                                   read_taisti_dataset_csv,
+                                   read_taisti_dataset_csv_soa)
 from taisti_linker.ontology_parser import OntologyParser
-from taisti_linker.similarity_calculator import SimilarityCalculator, SimilarityType
+from taisti_linker.similarity_calculator import (JaccardIndex, SimilarityCalculator,
+                                                 SimilarityType, SynsetIndex)
 from taisti_linker.text_processor import TextProcessor
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import argparse
 import csv
-import pickle
+import multiprocessing
 import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import re
+import sys
+
+
+class LabelMapping(Mapping):
+    """
+        Read-only view of per-category label maps backed by an Arrow table (e.g., a memory-mapped cache file).
+        The map of a category is materialized into LabelWithIRI objects on first access only.
+    """
+
+    SCHEMA = pa.schema([
+        ('entity_type', pa.int8()),
+        ('normalized_label', pa.string()),
+        ('label', pa.string()),
+        ('iri', pa.string()),
+    ])
+
+    def __init__(self, table: pa.Table):
+        self.table = table
+        self.entity_types = [
+            EntityType(value) for value in pc.unique(table['entity_type']).to_pylist()
+        ]
+        self._materialized: Dict[EntityType, Dict[str, LabelWithIRI]] = {}
+
+    @classmethod
+    def to_table(cls, mapping: Dict[EntityType, Dict[str, LabelWithIRI]]) -> pa.Table:
+        """
+            Flatten per-category label maps into a single Arrow table.
+
+            Args:
+                mapping (Dict[EntityType, Dict[str, LabelWithIRI]]): per-category label maps
+            Returns:
+                pa.Table: table with one row per (category, normalized label)
+        """
+        columns = {name: [] for name in cls.SCHEMA.names}
+        for entity_type, category_mapping in mapping.items():
+            for normalized_label, item in category_mapping.items():
+                columns['entity_type'].append(entity_type.value)
+                columns['normalized_label'].append(normalized_label)
+                columns['label'].append(item.label)
+                columns['iri'].append(item.iri)
+        return pa.Table.from_pydict(columns, schema=cls.SCHEMA)
+
+    def __getitem__(self, entity_type: EntityType) -> Dict[str, LabelWithIRI]:
+        if entity_type not in self._materialized:
+            if entity_type not in self.entity_types:
+                raise KeyError(entity_type)
+            rows = self.table.filter(
+                pc.equal(self.table['entity_type'], entity_type.value))
+            # normalized labels are interned, as are normalized texts looked up in the map
+            self._materialized[entity_type] = {
+                normalized_label: LabelWithIRI(label, iri, normalized_label, None)
+                for normalized_label, label, iri in zip(
+                    map(sys.intern, rows['normalized_label'].to_pylist()),
+                    rows['label'].to_pylist(),
+                    rows['iri'].to_pylist())
+            }
+        return self._materialized[entity_type]
+
+    def __contains__(self, entity_type: object) -> bool:
+        return entity_type in self.entity_types
+
+    def __iter__(self) -> Iterator[EntityType]:
+        return iter(self.entity_types)
+
+    def __len__(self) -> int:
+        return len(self.entity_types)
 
 
 class EntityLinker:
+    # documents are linked in chunks, rows of a chunk are written to the report at once through a large buffer
+    LINK_CHUNK_SIZE = 256
+    LINK_CACHE_SIZE = 1 << 20
+    PREPROCESS_CACHE_SIZE = 65536
+    WRITE_BUFFER_SIZE = 1 << 20
+
     def __init__(
         self,
         ontology_path: str,
@@ -31,75 +113,167 @@ class EntityLinker:
         self.min_acceptable_similarity = min_acceptable_similarity
         self.ignore_not_linkable = ignore_not_linkable
         self.similarity_measure = similarity_measure
-        self.ontology_parser = OntologyParser(ontology_path)
         self.text_processor = TextProcessor()
         self.similarity_calculator = SimilarityCalculator(
             similarity_measure, self.text_processor.normalize_text)
-        self.cache = {}
+        # results of `link` keyed by (text, entity_type), for texts not matching any label directly
+        self.link_cached = lru_cache(maxsize=self.LINK_CACHE_SIZE)(self.link)
+        # a text is preprocessed once, even if it is linked within several categories
+        self.preprocess_cached = lru_cache(maxsize=self.PREPROCESS_CACHE_SIZE)(
+            self.similarity_calculator.preprocess)
+        self.label_indexes: Dict[EntityType, Tuple[List[LabelWithIRI], Union[JaccardIndex, SynsetIndex]]] = {}
 
+        # annotations are stored column-wise, NER and TAISTI CSV readers fill the columns directly
         if len(ner_output_path) > 0:
-            self.annotated_docs = read_ner_annotation_file(ner_output_path)
+            self.annotations = read_ner_annotation_file_soa(ner_output_path)
         elif len(annotated_examples_base_path) > 0:
-            self.annotated_docs = \
-                read_brat_all_annotation_files(annotated_examples_base_path)
+            self.annotations = AnnotationsSoA.from_annotated_docs(
+                read_brat_all_annotation_files(annotated_examples_base_path))
         elif len(taisti_csv_path) > 0:
-            self.annotated_docs = \
-                read_taisti_dataset_csv(taisti_csv_path)
+            self.annotations = \
+                read_taisti_dataset_csv_soa(taisti_csv_path)
 
         self.normalized_label_mapping = \
             self.generate_label_mapping(self.text_processor)
 
-    def link_all(self, output_path: str) -> None:
+    @cached_property
+    def ontology_parser(self) -> OntologyParser:
+        """ The ontology is only loaded when the label mapping has to be generated, i.e., without a label cache """
+        return OntologyParser(self.ontology_path)
+
+    @cached_property
+    def annotated_docs(self) -> List[AnnotatedDoc]:
+        """
+            Annotations as AnnotatedDocs (with document texts), read again from the input on first access.
+            Linking uses the column-wise `annotations` only.
+        """
+        if len(self.ner_output_path) > 0:
+            return read_ner_annotation_file(self.ner_output_path)
+        elif len(self.annotated_examples_base_path) > 0:
+            return read_brat_all_annotation_files(self.annotated_examples_base_path)
+        elif len(self.taisti_csv_path) > 0:
+            return read_taisti_dataset_csv(self.taisti_csv_path)
+        return []
+
+    def link_all(self, output_path: str, n_jobs: int = 1, strict_csv: bool = False) -> None:
         """
-            Iterate over internally stored annotated docs and link all spans marked by NER/BRAT to ontology entities.
+            Iterate over internally stored annotations and link all spans marked by NER/BRAT to ontology entities.
             The result is then stored in a CSV file.
+            Documents are processed in chunks of LINK_CHUNK_SIZE docs, with n_jobs > 1 chunks are linked in parallel by
+            forked worker processes (threads on free-threaded Python builds), each starting from a copy of the linker state.
 
             Args:
                 output_path (str): link to a CSV report file
+                n_jobs (int): number of parallel workers (1 by default), linking is serial where fork is unavailable
+                strict_csv (bool): write rows with csv.writer instead of the faster hand-written formatter
+                                   (both produce the same output for the report columns)
         """
+        if n_jobs < 1:
+            raise ValueError(f"n_jobs must be at least 1, got {n_jobs}")
+        free_threaded = hasattr(sys, '_is_gil_enabled') and not sys._is_gil_enabled()
+        if n_jobs > 1 and not free_threaded and 'fork' not in multiprocessing.get_all_start_methods():
+            print("WARNING: fork start method is not available, linking serially")
+            n_jobs = 1
         print(f"INFO: Writing output to: {output_path}")
-        f = open(output_path, "w")
-        writer = csv.writer(f)
+        annotations = self.annotations
+        if n_jobs > 1:
+            # indexes of the categories present are built once, before forking (or starting threads), not by each worker
+            for category in annotations.categories:
+                entity_type = get_entity_type(category)
+                if entity_type in self.normalized_label_mapping:
+                    self._get_label_index(entity_type)
+        n_docs = len(annotations.doc_offsets) - 1
+        doc_ranges = [
+            (start, min(start + self.LINK_CHUNK_SIZE, n_docs))
+            for start in range(0, n_docs, self.LINK_CHUNK_SIZE)
+        ]
+
+        with open(output_path, "w", buffering=self.WRITE_BUFFER_SIZE, newline='') as f:
+            if strict_csv:
+                write_rows = csv.writer(f).writerows
+            else:
+                def write_rows(rows: List[list]) -> None:
+                    f.write("".join([_format_report_row(*row) for row in rows]))
+
+            if n_jobs == 1:
+                for start, end in doc_ranges:
+                    write_rows(self._link_docs(annotations, start, end))
+            elif free_threaded:
+                with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                    for rows in executor.map(
+                            lambda doc_range: self._link_docs(annotations, *doc_range), doc_ranges):
+                        write_rows(rows)
+            else:
+                with ProcessPoolExecutor(
+                    max_workers=n_jobs, mp_context=multiprocessing.get_context('fork'),
+                    initializer=_init_link_worker, initargs=(self, annotations)
+                ) as executor:
+                    for rows in executor.map(_link_docs_in_worker, doc_ranges):
+                        write_rows(rows)
+
+    def _link_docs(self, annotations: AnnotationsSoA, start_doc: int, end_doc: int) -> List[list]:
+        """
+            Link annotations of a range of documents.
+
+            Args:
+                annotations (AnnotationsSoA): annotations of all documents
+                start_doc (int): index of the first document to link
+                end_doc (int): index past the last document to link
+            Returns:
+                List[list]: CSV report rows
+        """
+        category_entity_types = [
+            get_entity_type(category) for category in annotations.categories
+        ]
+        category_label_mappings = [
+            self.normalized_label_mapping.get(entity_type, {})
+            for entity_type in category_entity_types
+        ]
+        doc_offsets = annotations.doc_offsets[start_doc:end_doc + 1].tolist()
+        first, last = doc_offsets[0], doc_offsets[-1]
+        ids = annotations.id[first:last]
+        file_ids = annotations.file_id[first:last].tolist()
+        starts = annotations.start[first:last].tolist()
+        ends = annotations.end[first:last].tolist()
+        category_codes = annotations.category_code[first:last].tolist()
+        texts = annotations.text[first:last]
+        normalize_text = self.text_processor.normalize_text
+        sources = [
+            AnnotationSource(code) for code in annotations.source_code[first:last].tolist()
+        ]
+        rows = []
 
-        for id, doc in enumerate(self.annotated_docs):
+        for id in range(start_doc, end_doc):
             if id % 500 == 0:
                 print(f"Processing step: {id}")
-            for annotation_id, annotation in enumerate(doc.annotations):
-                # print(f"Processing step {id}/{annotation_id}")
-                entity_text = annotation.text
-                entity_type = get_entity_type(annotation.category)
-                normalized_entity_text = \
-                    self.text_processor.normalize_text(entity_text)
-
-                linked_item: Optional[LabelWithIRI] = None
-                if entity_type in self.normalized_label_mapping and normalized_entity_text in self.normalized_label_mapping[entity_type]:
-                    linked_item = \
-                        self.normalized_label_mapping[entity_type][normalized_entity_text]
-                #    print(f"Direct match of {entity_text} to {linked_item}")
-                else:
-                    if normalized_entity_text not in self.cache:
-                        linked_item = self.link(
-                            normalized_entity_text, entity_type
-                        )
-                        self.cache[normalized_entity_text] = linked_item
-                    else:
-                        linked_item = self.cache[normalized_entity_text]
+            for i in range(doc_offsets[id - start_doc] - first, doc_offsets[id - start_doc + 1] - first):
+                # print(f"Processing step {id}/{i}")
+                entity_text = texts[i]
+                normalized_entity_text = normalize_text(entity_text)
+
+                linked_item: Optional[LabelWithIRI] = \
+                    category_label_mappings[category_codes[i]].get(normalized_entity_text)
+                if linked_item is None:
+                    linked_item = self.link_cached(
+                        normalized_entity_text, category_entity_types[category_codes[i]]
+                    )
 
                 annotation_data = [
-                    annotation.file_id,
-                    annotation.id,
-                    annotation.category,
-                    annotation.start,
-                    annotation.end,
-                    annotation.text,
-                    annotation.source
+                    file_ids[i],
+                    ids[i],
+                    annotations.categories[category_codes[i]],
+                    starts[i],
+                    ends[i],
+                    entity_text,
+                    sources[i]
                 ]
                 if linked_item:
-                    writer.writerow(
+                    rows.append(
                         annotation_data + [linked_item.iri, linked_item.label]
                     )
                 elif not self.ignore_not_linkable:
-                    writer.writerow(annotation_data + ["NONE", "NONE"])
+                    rows.append(annotation_data + ["NONE", "NONE"])
+        return rows
 
     def link(
         self, text: str, entity_type: EntityType
@@ -113,73 +287,107 @@ class EntityLinker:
             Returns:
                 Optional[LabelWithIRI]: linked entity or None if nothing is linked
         """
-        best_item = None
-        max_similarity = -1.0
-
         if entity_type not in self.normalized_label_mapping:
-            return best_item
-
-        category_label_mapping = self.normalized_label_mapping[entity_type]
-
-        text_preprocessed = self.similarity_calculator.preprocess(text)
-
-        for _, item in category_label_mapping.items():
-            # preprocess and cache representation required by similarity calculator
-            if not item.similarity_representation:
-                item.similarity_representation = self.similarity_calculator.preprocess(item.normalized_label)
-
-            # preprocess current text
-            current_label_similarity = self.similarity_calculator.calculate(
-                text_preprocessed, item.similarity_representation)
-
-            if (
-                current_label_similarity > self.min_acceptable_similarity
-                and current_label_similarity >= max_similarity
-            ):
-                max_similarity = current_label_similarity
-                best_item = item
-                #print(
-                #    f"Found new best: {item.normalized_label} with similarity {current_label_similarity}")
-            if current_label_similarity == 1.0:
-                break
-        return best_item
-
-    def generate_label_mapping(self, text_processor: TextProcessor) -> Dict[EntityType, Dict[str, LabelWithIRI]]:
+            return None
+
+        items, index = self._get_label_index(entity_type)
+        best, _ = index.best_match(
+            self.preprocess_cached(text), self.min_acceptable_similarity)
+        if best < 0:
+            return None
+        return items[best]
+
+    def _get_label_index(
+        self, entity_type: EntityType
+    ) -> Tuple[List[LabelWithIRI], Union[JaccardIndex, SynsetIndex]]:
+        """
+            Labels of a category along with an index over their similarity representations (built on first use).
+            Only labels that share a token (Jaccard, Everygram) or a synset (Wordnet) with a text are scored when linking it.
+
+            Args:
+                entity_type (EntityType): NER/BRAT entity type
+            Returns:
+                Tuple[List[LabelWithIRI], Union[JaccardIndex, SynsetIndex]]: labels and the index, positions in the index
+                                                                             correspond to positions in the list
+        """
+        if entity_type not in self.label_indexes:
+            items = list(self.normalized_label_mapping[entity_type].values())
+            self.label_indexes[entity_type] = (
+                items,
+                self.similarity_calculator.build_index(
+                    [item.normalized_label for item in items])
+            )
+        return self.label_indexes[entity_type]
+
+    def generate_label_mapping(self, text_processor: TextProcessor) -> Mapping:
         """
             From an ontology file, generate a map relating normalized labels of entities to their IRIs. Provide separate maps for each category.
-            Because the map generation process is time consuming, caching is introduced -- if cache is present ('./foodon_cache.pkl') the map is not
-            calculated. BEWARE: If normalization process changes, or ontology changes -- you have to remove the cache to recalculate the mapping.
+            Because the map generation process is time consuming, caching is introduced -- if cache is present ('./foodon_cache.arrow') the map is not
+            calculated. The cache is an Arrow IPC file that is memory-mapped on load, the maps of categories are built lazily (see LabelMapping).
+            BEWARE: If normalization process changes, or ontology changes -- you have to remove the cache to recalculate the mapping.
 
             Args:
                 text_processor (TextProcessor): text processor used to normalize ontology labels
             Returns:
-                Dict[EntityType, Dict[str, LabelWithIRI]]: For each allowed entity type (e.g., )
+                Mapping[EntityType, Dict[str, LabelWithIRI]]: For each allowed entity type (e.g., )
         """
-        cache_path = './foodon_cache.pkl'
+        cache_path = './foodon_cache.arrow'
 
         if os.path.exists(cache_path):
-            with open(cache_path, 'rb') as f:
-                return pickle.load(f)
+            table = pa.ipc.open_file(pa.memory_map(cache_path, 'r')).read_all()
+            return LabelMapping(table)
         else:
             print("Parsing ontology, it may take some time...")
             normalized_label_mapping = \
                 self.ontology_parser.get_IRI_labels_data_per_category(
                     normalizer=text_processor
                 )
-            with open(cache_path, 'wb') as f:
-                pickle.dump(normalized_label_mapping, f,
-                            protocol=pickle.HIGHEST_PROTOCOL)
+            table = LabelMapping.to_table(normalized_label_mapping)
+            with pa.OSFile(cache_path, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
             return normalized_label_mapping
 
 
+# characters that make csv.writer (QUOTE_MINIMAL) quote a field
+_CSV_SPECIAL_CHARS_RE = re.compile(r'[,"\r\n]')
+
+
+def _csv_text(value: str) -> str:
+    if _CSV_SPECIAL_CHARS_RE.search(value):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def _format_report_row(file_id: int, id: str, category: str, start: int, end: int, text: str,
+                       source: AnnotationSource, iri: str, label: str) -> str:
+    """ Format a link report row exactly as csv.writer with default settings would """
+    return f"{file_id},{_csv_text(id)},{_csv_text(category)},{start},{end},{_csv_text(text)}," \
+           f"{source},{_csv_text(iri)},{_csv_text(label)}\r\n"
+
+
+# state of a link_all worker process, inherited from the parent process on fork
+_link_worker_state: Optional[Tuple[EntityLinker, AnnotationsSoA]] = None
+
+
+def _init_link_worker(linker: EntityLinker, annotations: AnnotationsSoA) -> None:
+    global _link_worker_state
+    _link_worker_state = (linker, annotations)
+
+
+def _link_docs_in_worker(doc_range: Tuple[int, int]) -> List[list]:
+    linker, annotations = _link_worker_state
+    return linker._link_docs(annotations, *doc_range)
+
+
 def main(ontology_path: str, annotations_path: str, output_file_path: str,
          ner_output: str, taisti_csv_path: str, ignore_not_linkable: bool,
-         similarity_measure: SimilarityType):
+         similarity_measure: SimilarityType, n_jobs: int = 1, strict_csv: bool = False):
     """ Entry point """
     el = EntityLinker(ontology_path, annotations_path, ner_output, taisti_csv_path,
                       ignore_not_linkable=ignore_not_linkable,
                       similarity_measure=similarity_measure)
-    el.link_all(output_file_path)
+    el.link_all(output_file_path, n_jobs, strict_csv)
 
 
 if __name__ == "__main__":
@@ -214,8 +422,18 @@ if __name__ == "__main__":
                         help='Similarity measure: J: Jaccard, E: Everygrams, W: Wordnet',
                         type=str,
                         default='J')
+    parser.add_argument('-j', '--jobs',
+                        help='Number of parallel linking workers',
+                        type=int,
+                        default=1)
+    parser.add_argument('-strict', '--strict_csv',
+                        help='Write the report with the csv module instead of the faster built-in formatter',
+                        action='store_true')
 
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error(f"argument -j/--jobs: must be at least 1, got {args.jobs}")
     main(args.ontology_path, args.annotations_path, args.output_file_path,
          args.ner_output, args.taisti_csv, args.ignore_not_linkable,
-         SimilarityCalculator.similarity_id_to_type(args.similarity))
+         SimilarityCalculator.similarity_id_to_type(args.similarity), args.jobs,
+         args.strict_csv)
@@ -8,9 +8,19 @@ from typing import Any, Dict, List
 class OntologyParser:
     """ A class for loading ontologies and managing label -> IRI maps """
 
+    # properties holding alternative labels of an entity
+    SYNONYM_PROP_NAMES = [
+        "http://www.geneontology.org/formats/oboInOwl#hasSynonym",
+        "http://www.geneontology.org/formats/oboInOwl#hasExactSynonym",
+        #"http://www.geneontology.org/formats/oboInOwl#hasBroadSynonym",
+        "http://www.geneontology.org/formats/oboInOwl#hasNarrowSynonym",
+        "http://purl.obolibrary.org/obo/IAO_0000118",  # alternative term
+    ]
+
     def __init__(self, ontology_path: str):
         self.ontology = owlready2.get_ontology(ontology_path).load()
         self.type_to_root_entity = self._get_root_nodes_for_categories()
+        self.synonym_props = [owlready2.IRIS[prop_name] for prop_name in self.SYNONYM_PROP_NAMES]
         self.enabled_warnings = False
 
     def get_possible_labels(self, obj: Any) -> List[str]:
@@ -22,17 +32,10 @@ class OntologyParser:
             Returns:
                 List[str]: list of labels
         """
-        prop_names = [
-            "http://www.geneontology.org/formats/oboInOwl#hasSynonym",
-            "http://www.geneontology.org/formats/oboInOwl#hasExactSynonym",
-            #"http://www.geneontology.org/formats/oboInOwl#hasBroadSynonym",
-            "http://www.geneontology.org/formats/oboInOwl#hasNarrowSynonym",
-            "http://purl.obolibrary.org/obo/IAO_0000118",  # alternative term
-        ]
+        obj_props = set(obj.get_properties(obj))
         synonyms = [self._get_label(obj)]
-        for prop_name in prop_names:
-            prop = owlready2.IRIS[prop_name]
-            if prop in obj.get_properties(obj):
+        for prop in self.synonym_props:
+            if prop in obj_props:
                 synonyms += [str(s) for s in prop[obj]]
         return list(set(synonyms))
 
@@ -51,14 +54,20 @@ class OntologyParser:
         """
         result: Dict[str, LabelWithIRI] = dict()
 
+        labels: List[str] = []
+        iris: List[str] = []
         for root in self.type_to_root_entity[category]:
             for c in root.descendants():
                 for label in self.get_possible_labels(c):
-                    normalized_label = normalizer.normalize_text(label)
-                    if self.enabled_warnings and normalized_label in result:
-                        print(f"WARNING: {normalized_label} already in mapping")
-                    result[normalized_label] = \
-                        LabelWithIRI(label, c.iri, normalized_label, None)
+                    labels.append(label)
+                    iris.append(c.iri)
+
+        # all labels of the category are normalized in a single batch
+        for label, iri, normalized_label in zip(labels, iris, normalizer.normalize_batch(labels)):
+            if self.enabled_warnings and normalized_label in result:
+                print(f"WARNING: {normalized_label} already in mapping")
+            result[normalized_label] = \
+                LabelWithIRI(label, iri, normalized_label, None)
         return result
 
     def get_IRI_labels_data_per_category(
@@ -67,6 +76,7 @@ class OntologyParser:
         """
             Calculate a map that for each NER/BRAT category (e.g., FOOD, COLOR, PROCESS)
             relates all allowed (normalized) entity labels to their IRIs.
+            Categories are processed serially, worker processes (each loading the ontology again) measured slower.
 
             Args:
                 normalizer (TextProcessor): A normalizer that can transform labels into normalized forms.
@@ -118,3 +128,4 @@ class OntologyParser:
                 "http://purl.obolibrary.org/obo/BFO_0000001"
             ]]
         }
+
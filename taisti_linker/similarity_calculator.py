@@ -1,8 +1,9 @@
 from enum import Enum
-from typing import Any, Callable, List, Optional, Set
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple, Union
 from nltk.util import everygrams
 from nltk import pos_tag, word_tokenize
 from nltk.corpus import wordnet as wn
+import numpy as np
 
 
 class SimilarityType(Enum):
@@ -11,6 +12,128 @@ class SimilarityType(Enum):
     WORDNET = 3
 
 
+class JaccardIndex:
+    """
+        Sparse label x token incidence matrix, scoring a query against all indexed labels at once.
+        The matrix is stored token-major (an inverted index), so only labels sharing a token with the query are visited.
+    """
+
+    def __init__(self, representations: List[Iterable[Hashable]]):
+        """
+            Map every token to an integer id and, for every token id, store the ids of labels containing it
+            in a single flat array (`postings[token_offsets[t]:token_offsets[t + 1]]` are labels containing token `t`).
+
+            Args:
+                representations (List[Iterable[Hashable]]): set-like representations of labels
+                                                            (sets of tokens or arrays of unique token hashes)
+        """
+        self.vocabulary: Dict[Hashable, int] = dict()
+        indices, sizes = [], []
+        for representation in representations:
+            for token in self._tokens(representation):
+                indices.append(
+                    self.vocabulary.setdefault(token, len(self.vocabulary)))
+            sizes.append(len(representation))
+
+        indices = np.asarray(indices, dtype=np.int32)
+        self.label_sizes = np.asarray(sizes, dtype=np.int64)
+        rows = np.repeat(
+            np.arange(len(sizes), dtype=np.int32), self.label_sizes)
+
+        # stable sort keeps label ids ascending within every token
+        self.postings = rows[np.argsort(indices, kind='stable')]
+        self.token_offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(indices, minlength=len(self.vocabulary)),
+                  out=self.token_offsets[1:])
+
+    def best_match(self, query: Set[Hashable], threshold: float) -> Tuple[int, float]:
+        """
+            Find the most similar indexed representation, considering only those sharing at least one token with the query.
+
+            Args:
+                query (Set[Hashable]): set-like representation of a query
+                threshold (float): a non-negative score the best match has to exceed
+            Returns:
+                Tuple[int, float]: index of the best (first, in case of ties) representation and its score,
+                                   (-1, 0.0) if no representation scores above the threshold
+        """
+        hits = self._hits(query)
+        if len(hits) > 0 and threshold > 0:
+            # Jaccard similarity is bounded by min(|A|, |B|) / max(|A|, |B|), labels too short or too long
+            # to score above the threshold (judging by their sizes only) are dropped before counting intersections
+            hit_sizes = self.label_sizes[hits]
+            hits = hits[np.minimum(hit_sizes, len(query)) / np.maximum(hit_sizes, len(query)) > threshold]
+        if len(hits) == 0:
+            return -1, 0.0
+
+        candidates, intersection = np.unique(hits, return_counts=True)
+        scores = intersection / \
+            (self.label_sizes[candidates] + len(query) - intersection)
+        best = int(np.argmax(scores))
+        if scores[best] <= threshold:
+            return -1, 0.0
+        return int(candidates[best]), float(scores[best])
+
+    def _hits(self, query: Set[Hashable]) -> np.ndarray:
+        """ Ids of labels containing each of the query tokens (a label is repeated once per shared token) """
+        query_ids = [
+            self.vocabulary[t] for t in self._tokens(query) if t in self.vocabulary
+        ]
+        if not query_ids:
+            return np.zeros(0, dtype=np.int32)
+        return np.concatenate([
+            self.postings[self.token_offsets[t]:self.token_offsets[t + 1]] for t in query_ids
+        ])
+
+    @staticmethod
+    def _tokens(representation: Iterable[Hashable]) -> Iterable[Hashable]:
+        """ Iterate over Python objects rather than NumPy scalars when a representation is an array """
+        if isinstance(representation, np.ndarray):
+            return representation.tolist()
+        return representation
+
+
+class SynsetIndex:
+    """ Inverted index relating WordNet synsets to labels whose representations contain them """
+
+    def __init__(self, representations: List[List[Any]], similarity: Callable[[Any, Any], float]):
+        """
+            Args:
+                representations (List[List[Any]]): synsets of labels
+                similarity (Callable[[Any, Any], float]): similarity measure between a query and a label representation
+        """
+        self.representations = representations
+        self.similarity = similarity
+        self.synset_to_labels: Dict[Any, List[int]] = dict()
+        for i, representation in enumerate(representations):
+            for synset in set(representation):
+                self.synset_to_labels.setdefault(synset, []).append(i)
+
+    def best_match(self, query: List[Any], threshold: float) -> Tuple[int, float]:
+        """
+            Find the most similar indexed representation, considering only those sharing at least one synset with the query.
+
+            Args:
+                query (List[Any]): synsets of a query
+                threshold (float): a score the best match has to exceed
+            Returns:
+                Tuple[int, float]: index of the best (first, in case of ties) representation and its score,
+                                   (-1, 0.0) if no representation scores above the threshold
+        """
+        candidates = set()
+        for synset in query:
+            candidates.update(self.synset_to_labels.get(synset, ()))
+
+        best, max_similarity = -1, 0.0
+        for i in sorted(candidates):
+            similarity = self.similarity(query, self.representations[i])
+            if similarity > threshold and (best < 0 or similarity > max_similarity):
+                best, max_similarity = i, similarity
+            if similarity == 1.0:
+                break
+        return best, max_similarity
+
+
 class SimilarityCalculator:
     """ Similarity metrics container """
 
@@ -22,6 +145,7 @@ class SimilarityCalculator:
         """
             Based on a similiraty measure id (either `j`, `e` or `w` for Jaccard, Everygram, Wordnet)
             calculate appropriate similarity measure.
+            To score a text against many labels, use the index returned from `build_index` instead.
 
             Args:
                 repr_a (Any): left-hand-side similarity argument
@@ -56,6 +180,21 @@ class SimilarityCalculator:
         elif self.similarity_type == SimilarityType.WORDNET:
             return self._wordnet_preprocess(text, normalize)
 
+    def build_index(self, texts: List[str]) -> Union[JaccardIndex, SynsetIndex]:
+        """
+            Preprocess all texts (e.g., normalized labels of a category) and index them for finding the best match of a query.
+            Jaccard and Everygram representations are indexed for vectorized Jaccard scoring, Wordnet ones by their synsets.
+
+            Args:
+                texts (List[str]): texts to index
+            Returns:
+                Union[JaccardIndex, SynsetIndex]: index over preprocessed texts
+        """
+        representations = [self.preprocess(text) for text in texts]
+        if self.similarity_type == SimilarityType.WORDNET:
+            return SynsetIndex(representations, self.calculate)
+        return JaccardIndex(representations)
+
     @staticmethod
     def similarity_id_to_type(similarity_measure_id: str = 'j') -> SimilarityType:
         """
@@ -83,7 +222,10 @@ class SimilarityCalculator:
     def _everygrams_preprocess(self, text: str, normalize: bool = False) -> Any:
         if normalize:
             text = self.normalizer(text)
-        return set(everygrams(text.split()))
+        # everygrams are represented as sorted unique 64-bit hashes (stable within a process only)
+        hashes = np.fromiter(
+            (hash(gram) for gram in everygrams(text.split())), dtype=np.int64)
+        return np.unique(hashes)
 
     def _wordnet_preprocess(self, text: str, normalize: bool = False) -> Any:
         text = pos_tag(word_tokenize(text))
@@ -107,13 +249,13 @@ class SimilarityCalculator:
         else:
             return 1.0 * len(a.intersection(b)) / len(a.union(b))
 
-    def _everygrams(self, a: Set[str], b: Set[str]) -> float:
+    def _everygrams(self, a: np.ndarray, b: np.ndarray) -> float:
         """
             Jaccard based similarity between two texts represented as everygrams.
 
             Args:
-                a (Set[str]): first argument
-                b (Set[str]): second argument
+                a (np.ndarray): first argument, sorted unique everygram hashes
+                b (np.ndarray): second argument, sorted unique everygram hashes
             Returns:
                 float: Jaccard similarity score between everygrams.
         """
@@ -121,7 +263,8 @@ class SimilarityCalculator:
         if len(a) == 0 or len(b) == 0:
             return 0.0
         else:
-            return 1.0 * len(a.intersection(b)) / len(a.union(b))
+            intersection = len(np.intersect1d(a, b, assume_unique=True))
+            return 1.0 * intersection / (len(a) + len(b) - intersection)
 
     def _wordnet(self, synsets1: List[Any], synsets2: List[Any]) -> float:
         """
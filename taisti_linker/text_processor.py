@@ -1,32 +1,146 @@
-from nltk.stem import PorterStemmer
-from typing import Any, Set
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, List, Set
+from Stemmer import Stemmer
 import re
-import spacy
+import sys
+import threading
+
+
+_NOT_LETTERS_RE = re.compile(r"[^a-z]")
+
+
+class _CleanTable(dict):
+    """
+        str.translate table lowercasing letters and turning all other characters into spaces.
+        Entries of non-ASCII characters are only computed when they are encountered.
+    """
+
+    def __missing__(self, char: int) -> str:
+        translation = _NOT_LETTERS_RE.sub(" ", chr(char).lower())
+        self[char] = translation
+        return translation
+
+
+_CLEAN_TABLE = _CleanTable()
+# the same, but keeping TextProcessor.BATCH_SEPARATOR
+_CLEAN_BATCH_TABLE = _CleanTable({0: "\x00"})
+_STOPWORDS = frozenset(("the", "a", "an", "at", "by", "for", "in", "into", "on", "to"))
+
+
+class _ThreadStemmer(threading.local):
+    """
+        C implementation of the Porter stemmer, it also caches stems of the (small) vocabulary of labels and NER outputs.
+        A stemmer must not be used concurrently, so each thread (e.g., a link_all worker thread) gets its own.
+    """
+
+    def __init__(self):
+        self.stemmer = Stemmer("porter")
+        self.stemmer.maxCacheSize = 50000
+
+
+_thread_stemmer = _ThreadStemmer()
+
+
+def _clean(text: str, table: _CleanTable = _CLEAN_TABLE) -> str:
+    """
+        Drop (whole) (hackish, in foodon default entities are annotated with it) and replace all characters
+        but letters with spaces, the result is lowercased.
+    """
+    return text.lower().replace("(whole)", " ").translate(table)
+
+
+@lru_cache(maxsize=65536)
+def _normalize_tokens(text: str) -> str:
+    """
+        Remove stopwords from and stem a lowercased text consisting of words separated by whitespace.
+        The result is interned, so that lookups of normalized texts in maps keyed by (interned) normalized labels
+        succeed on identity comparison.
+    """
+    # the text only consists of lowercase letters and spaces, so splitting on whitespace tokenizes it
+    tokens = [t for t in text.split() if t not in _STOPWORDS]
+    # like NLTK's PorterStemmer, words of up to 2 letters are kept as they are
+    # (the original algorithm stems e.g. the 's' of possessives to an empty string and 'is' to 'i')
+    stems = _thread_stemmer.stemmer.stemWords(tokens)
+    return sys.intern(" ".join([token if len(token) <= 2 else stem for token, stem in zip(tokens, stems)]))
+
+
+@lru_cache(maxsize=65536)
+def _normalize_cached(text: str) -> str:
+    """ Normalize a raw text, the same labels and NER outputs (e.g., 'salt', 'sugar') come up over and over again """
+    return _normalize_tokens(_clean(text))
 
 
 class TextProcessor:
     """ A class providing text-realted utilities """
 
-    def __init__(self):
-        self.nlp = spacy.load("en_core_web_trf")
-        self.ps = PorterStemmer()
+    # separates texts normalized in a single batch, it is neither a letter nor whitespace so it survives cleaning
+    BATCH_SEPARATOR = "\x00"
 
     def normalize_text(self, text: str) -> str:
         """
             Normalize ontology labels and NER outputs to increase the chance of a match.
+            Results are cached across all TextProcessor instances.
 
             Args:
                 text (str): text to normalize
             Returns:
                 str: ormalized text
         """
-        stopwords = ['the', 'a', 'an', 'at',
-                     'by', 'for', 'in', 'into', 'on', 'to']
-        # Hackish, in foodon default entities are annotated with (whole)
-        text = re.sub(r"\(whole\)", "", text)
-        text = re.sub(r"[^a-zA-Z]", " ", text)
-        text = re.sub(r"\s+", " ", text)
-        text = text.lower()
-        text = " ".join([t for t in text.split(" ") if t not in stopwords])
-        text = " ".join([self.ps.stem(token.text) for token in self.nlp(text)])
-        return text
+        return _normalize_cached(text)
+
+    def normalize_batch(self, texts: List[str], batch_size: int = 1024, n_process: int = 1) -> List[str]:
+        """
+            Normalize a list of texts, equivalent to calling `normalize_text` on each of them.
+            Texts are cleaned in batches of batch_size texts joined with BATCH_SEPARATOR.
+            Normalization is CPU-bound string processing that is cheap per text, so with n_process > 1 the batches are
+            normalized by a pool of worker processes, which only pays off for large inputs (e.g., all labels of an
+            ontology), as every batch has to be sent to a worker and back.
+
+            Args:
+                texts (List[str]): texts to normalize
+                batch_size (int): number of texts cleaned at once (and sent to a worker process)
+                n_process (int): number of worker processes (1 by default -- normalize in the calling process)
+            Returns:
+                List[str]: normalized texts
+        """
+        batches = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+        if n_process > 1 and len(batches) > 1:
+            with ProcessPoolExecutor(max_workers=n_process) as executor:
+                # strings unpickled from workers are not interned anymore
+                return [
+                    sys.intern(text)
+                    for normalized_texts in executor.map(_normalize_batch_in_worker, batches)
+                    for text in normalized_texts
+                ]
+        return [text for batch in batches for text in self._normalize_batch(batch)]
+
+    def _normalize_batch(self, texts: List[str]) -> List[str]:
+        """
+            Normalize a list of texts at once.
+
+            Args:
+                texts (List[str]): texts to normalize
+            Returns:
+                List[str]: normalized texts
+        """
+        if not texts:
+            return []
+        text = self.BATCH_SEPARATOR.join(texts)
+        if text.count(self.BATCH_SEPARATOR) != len(texts) - 1:
+            # the separator occurs in the texts themselves
+            return [self.normalize_text(text) for text in texts]
+
+        text = _clean(text, _CLEAN_BATCH_TABLE)
+        return [_normalize_tokens(t) for t in text.split(self.BATCH_SEPARATOR)]
+
+    @staticmethod
+    def clear_cache():
+        """ Drop all cached normalization results, e.g., after a corpus has been processed """
+        _normalize_cached.cache_clear()
+        _normalize_tokens.cache_clear()
+
+
+def _normalize_batch_in_worker(texts: List[str]) -> List[str]:
+    """ Worker of TextProcessor.normalize_batch normalizing a single batch of texts """
+    return TextProcessor()._normalize_batch(texts)